@@ -2,9 +2,14 @@
 
 import streamlit as st
 import cv2
-import numpy as np
 import logging
 import datetime
+import hashlib
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from PIL import Image
 import tqdm
 # 配置日志
@@ -37,83 +42,177 @@ mysql_config = {
     "database": APP_CONFIG.get("mysql_database", "medical_images"),
 }
 
-history_manager = HistoryManager(
-    max_entries=APP_CONFIG["max_history_entries"],
-    db_enabled=APP_CONFIG.get("db_enabled", False),
-    db_path=APP_CONFIG.get("db_path", "medical_images.db"),
-    db_type=APP_CONFIG.get("db_type", "sqlite"),
-    mysql_config=mysql_config
-)
-
 # 初始化session_state
 def init_session_state():
     """初始化session_state"""
     if 'history' not in st.session_state:
-        st.session_state.history = []
+        # 固定长度的双端队列，超出上限时自动淘汰最旧的记录
+        st.session_state.history = deque(maxlen=APP_CONFIG["max_history_entries"])
     if 'current_image' not in st.session_state:
         st.session_state.current_image = None
     if 'enhanced_image' not in st.session_state:
         st.session_state.enhanced_image = None
     if 'image_stats' not in st.session_state:
         st.session_state.image_stats = None
+    if 'image_histogram' not in st.session_state:
+        st.session_state.image_histogram = None
+    if 'download_data' not in st.session_state:
+        st.session_state.download_data = None
+    if '_last_key' not in st.session_state:
+        st.session_state._last_key = None
+    if 'history_manager' not in st.session_state:
+        # 管理器随会话保留，数据库连接池可在多次重跑之间复用
+        st.session_state.history_manager = HistoryManager(
+            max_entries=APP_CONFIG["max_history_entries"],
+            db_enabled=APP_CONFIG.get("db_enabled", False),
+            db_path=APP_CONFIG.get("db_path", "medical_images.db"),
+            db_type=APP_CONFIG.get("db_type", "sqlite"),
+            mysql_config=mysql_config
+        )
 
 # 核心图像处理函数
-def process_single_image(uploaded_file, controls):
-    """处理单个图像的核心函数"""
-    try:
-        logger.info(f"开始处理文件: {uploaded_file.name}")
+def process_single_image(filename, file_bytes, controls, img=None, parallel=True):
+    """处理单个图像的核心函数（接收原始字节或已解码图像，可在线程池中调用）
     
-        # 读取文件
-        file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
-        logger.info(f"文件读取成功，大小: {len(file_bytes)} bytes")
+    在批量处理的工作线程中调用时传入parallel=False，不再启动多线程的伪彩色内核。
+    """
+    try:
+        logger.debug("开始处理文件: %s", filename)
     
-        # 解码图像
-        img = cv2.imdecode(file_bytes, cv2.IMREAD_UNCHANGED)
+        # 解码图像（批量模式下可能已由GPU批量解码）
+        if img is None:
+            logger.debug("文件读取成功，大小: %d bytes", len(file_bytes))
+            img = processor.decode_image(file_bytes)
         if img is None:
             raise ValueError("无法解码图像文件")
-        logger.info(f"图像解码成功，尺寸: {img.shape}")
+        logger.debug("图像解码成功，尺寸: %s", img.shape)
     
-        # 预处理图像
-        preprocessed_img = processor.preprocess_image(
+        # 预处理图像并计算统计信息（预处理结果只是中间数据，写入线程内复用的缓冲区）
+        preproc = processor.preprocess_and_analyze(
             img,
             apply_clahe=controls["apply_clahe"],
             contrast=controls["contrast"],
-            brightness=controls["brightness"]
+            brightness=controls["brightness"],
+            out=processor.scratch_buffer("preprocessed", img.shape[:2])
         )
-        logger.info("图像预处理完成")
+        stats = preproc.stats
+        logger.debug("图像预处理完成，统计信息: %s", stats)
     
         # 伪彩色增强
         enhanced_img = processor.enhance_pseudocolor(
-            preprocessed_img,
-            controls["color_scheme"]
+            preproc.image,
+            controls["color_scheme"],
+            parallel=parallel
         )
-        logger.info(f"伪彩色增强完成，使用颜色方案: {controls['color_scheme']}")
-    
-        # 计算图像统计
-        stats = processor.calculate_image_stats(img)
-        logger.info(f"图像统计计算完成: {stats}")
+        logger.debug("伪彩色增强完成，使用颜色方案: %s", controls["color_scheme"])
     
         return {
-            "filename": uploaded_file.name,
+            "filename": filename,
             "original_image": img,
             "enhanced_image": enhanced_img,
             "stats": stats,
+            "histogram": preproc.histogram,
             "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
         
+    # 调用方会记录完整堆栈，这里只记录简要信息，避免每个文件重复格式化traceback
     except ValueError as ve:
-        logger.error(f"值错误: {str(ve)}", exc_info=True)
+        logger.error("值错误: %s (%s)", ve, filename)
         raise
     except cv2.error as cv_err:
-        logger.error(f"OpenCV错误: {str(cv_err)}", exc_info=True)
+        logger.error("OpenCV错误: %s (%s)", cv_err, filename)
         raise
     except MemoryError:
-        logger.error("内存错误", exc_info=True)
+        logger.error("内存错误 (%s)", filename)
         raise
     except Exception as e:
-        logger.error(f"未知错误: {str(e)}", exc_info=True)
+        logger.error("未知错误: %s (%s)", e, filename)
         raise
 
+# 批量处理流水线参数
+BATCH_QUEUE_SIZE = 4
+GPU_DECODE_CHUNK = 8
+
+def process_batch(uploaded_files, controls, on_progress=None):
+    """批量处理：生产者线程读取（可选GPU解码）文件，消费者线程并行处理，进度回调在主线程执行"""
+    total = len(uploaded_files)
+    results = [None] * total
+    errors = []
+    completed = [0]
+    lock = threading.Lock()
+    work_queue = queue.Queue(maxsize=BATCH_QUEUE_SIZE)
+    num_workers = os.cpu_count() or 1
+
+    def produce():
+        try:
+            for start in range(0, total, GPU_DECODE_CHUNK):
+                chunk = [
+                    (idx, f.name, f.getvalue())
+                    for idx, f in enumerate(uploaded_files[start:start + GPU_DECODE_CHUNK], start)
+                ]
+                # 有GPU时按小批量解码，其余文件由消费者线程回退到OpenCV解码
+                decoded = processor.decode_images_gpu([data for _, _, data in chunk])
+                for (idx, name, data), img in zip(chunk, decoded):
+                    work_queue.put((idx, name, data, img))
+        finally:
+            for _ in range(num_workers):
+                work_queue.put(None)
+
+    def consume():
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            idx, name, data, img = item
+            try:
+                # 各工作线程已并行处理不同文件，单个文件内不再开启多线程
+                results[idx] = process_single_image(name, data, controls, img, parallel=False)
+            except Exception as e:
+                errors.append(e)
+            with lock:
+                completed[0] += 1
+
+    # OpenCV在解码/CLAHE等操作中会释放GIL，读取与处理可以在多核上重叠进行
+    with ThreadPoolExecutor(max_workers=num_workers + 1) as executor:
+        futures = [executor.submit(produce)] + [executor.submit(consume) for _ in range(num_workers)]
+        pending = set(futures)
+        while pending:
+            _, pending = wait(pending, timeout=0.1)
+            if on_progress:
+                with lock:
+                    done = completed[0]
+                on_progress(done, total)
+    
+    for future in futures:
+        future.result()
+    if errors:
+        raise errors[0]
+    logger.info("批量处理完成，共 %d 个文件", total)
+    return results
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _process_cached(file_digest, filename, _file_bytes, controls_tuple):
+    """按文件内容摘要和处理参数缓存单图像处理结果（_file_bytes不参与缓存键计算）
+    
+    结果中同时缓存下载用的JPEG字节，同一图像与参数只编码一次。
+    """
+    apply_clahe, contrast, brightness, color_scheme = controls_tuple
+    controls = {
+        "apply_clahe": apply_clahe,
+        "contrast": contrast,
+        "brightness": brightness,
+        "color_scheme": color_scheme,
+    }
+    result = process_single_image(filename, _file_bytes, controls)
+    result["download_data"] = processor.encode_jpeg(result["enhanced_image"], quality=95)
+    return result
+
+def _show_write_failures(history_manager):
+    """提示后台数据库写入失败的记录（写入在后台线程完成，失败时页面此前已显示保存成功）"""
+    failures, error = history_manager.pop_write_failures()
+    if failures:
+        st.error(f"❌ {failures} 条历史记录未能保存到数据库: {error}")
+
 # 主应用
 def main():
     # 设置页面配置
@@ -121,6 +220,8 @@ def main():
     
     # 初始化session_state
     init_session_state()
+    history_manager = st.session_state.history_manager
+    _show_write_failures(history_manager)
     
     # 创建页面头部
     ui.create_header(len(st.session_state.history))
@@ -164,25 +265,17 @@ def main():
                 st.info(f"已上传 {len(uploaded_files)} 个文件，准备开始批量处理...")
                 
                 if st.button("🚀 开始批量处理", type="primary"):
-                    from tqdm import tqdm
-                    import time
-                    
                     batch_results = []
                     progress_bar = st.progress(0)
                     status_text = st.empty()
                     
                     try:
-                        for idx, uploaded_file in enumerate(uploaded_files):
-                            logger.info(f"批量处理文件 {idx+1}/{len(uploaded_files)}: {uploaded_file.name}")
-                            status_text.text(f"处理中: {uploaded_file.name} ({idx+1}/{len(uploaded_files)})")
-                            
-                            # 使用统一的单图像处理函数
-                            result = process_single_image(uploaded_file, controls)
-                            batch_results.append(result)
-                            
-                            # 更新进度
-                            progress_bar.progress((idx + 1) / len(uploaded_files))
-                            time.sleep(0.1)  # 给UI一点刷新时间
+                        def update_progress(done, total):
+                            # 只在主线程中操作Streamlit组件
+                            status_text.text(f"处理中: {done}/{total}")
+                            progress_bar.progress(done / total)
+                        
+                        batch_results = process_batch(uploaded_files, controls, on_progress=update_progress)
                         
                         # 处理完成
                         status_text.success(f"✅ 批量处理完成！共处理 {len(batch_results)} 个文件")
@@ -206,16 +299,12 @@ def main():
                                     }
                                     batch_history_entries.append(entry)
                                     
-                                # 更新内存中的历史记录
-                                st.session_state.history = batch_history_entries + st.session_state.history
-                                if len(st.session_state.history) > APP_CONFIG["max_history_entries"]:
-                                    st.session_state.history = st.session_state.history[:APP_CONFIG["max_history_entries"]]
+                                # 更新内存中的历史记录（逆序插入队首，保持批次内顺序）
+                                st.session_state.history.extendleft(reversed(batch_history_entries))
                                 
-                                # 批量保存到数据库
+                                # 批量保存到数据库（后台线程提交，不阻塞页面）
                                 if history_manager.db_enabled:
-                                    from modules.history_manager import HistoryEntry
-                                    history_objects = [HistoryEntry(**entry) for entry in batch_history_entries]
-                                    history_manager.save_entries_to_db(history_objects)
+                                    history_manager.save_entries_async(batch_history_entries)
                                 
                                 st.success(f"✅ 已保存到历史记录，共 {len(batch_history_entries)} 条")
                             
@@ -225,13 +314,11 @@ def main():
                                 import io
                                 
                                 zip_buffer = io.BytesIO()
-                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+                                # JPEG本身已压缩，DEFLATE只会浪费CPU，直接存储
+                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zf:
                                     for result in batch_results:
-                                        pil_img = processor.convert_to_pil(result["enhanced_image"])
-                                        img_buffer = io.BytesIO()
-                                        pil_img.save(img_buffer, format="JPEG", quality=95)
-                                        img_buffer.seek(0)
-                                        zf.writestr(f"enhanced_{result['filename']}", img_buffer.read())
+                                        # 增强图像本身就是BGR，可直接交给OpenCV编码
+                                        zf.writestr(f"enhanced_{result['filename']}", processor.encode_jpeg(result["enhanced_image"], quality=95))
                                 
                                 zip_buffer.seek(0)
                                 st.download_button(
@@ -248,10 +335,10 @@ def main():
                                     col1, col2 = st.columns(2)
                                     with col1:
                                         st.markdown("**原始图像**")
-                                        st.image(result["original_image"], caption=f"原始尺寸: {result['original_image'].shape[1]}x{result['original_image'].shape[0]}", use_column_width=True)
+                                        ui.show_preview_image(result["original_image"], caption=f"原始尺寸: {result['original_image'].shape[1]}x{result['original_image'].shape[0]}")
                                     with col2:
                                         st.markdown("**增强图像**")
-                                        st.image(result["enhanced_image"], caption=f"增强尺寸: {result['enhanced_image'].shape[1]}x{result['enhanced_image'].shape[0]}", use_column_width=True)
+                                        ui.show_preview_image(result["enhanced_image"], caption=f"增强尺寸: {result['enhanced_image'].shape[1]}x{result['enhanced_image'].shape[0]}")
                                 
                             if len(batch_results) > 5:
                                 st.info(f"共 {len(batch_results)} 个结果，仅显示前5个。请使用打包下载功能获取所有结果。")
@@ -271,44 +358,40 @@ def main():
 
             if uploaded_file:
                 try:
-                    logger.info(f"开始处理文件: {uploaded_file.name}")
-                
-                    # 读取文件
-                    file_bytes = np.asarray(bytearray(uploaded_file.read()), dtype=np.uint8)
-                    logger.info(f"文件读取成功，大小: {len(file_bytes)} bytes")
-                
-                    # 解码图像
-                    img = cv2.imdecode(file_bytes, cv2.IMREAD_UNCHANGED)
-                    if img is None:
-                        raise ValueError("无法解码图像文件")
-                    logger.info(f"图像解码成功，尺寸: {img.shape}")
-                
-                    # 预处理图像
-                    with st.spinner("🔄 正在预处理图像..."):
-                        preprocessed_img = processor.preprocess_image(
-                            img,
-                            apply_clahe=controls["apply_clahe"],
-                            contrast=controls["contrast"],
-                            brightness=controls["brightness"]
-                        )
-                    logger.info("图像预处理完成")
-                
-                    # 伪彩色增强
-                    with st.spinner("🎨 正在应用伪彩色增强..."):
-                        enhanced_img = processor.enhance_pseudocolor(
-                            preprocessed_img,
-                            controls["color_scheme"]
-                        )
-                    logger.info(f"伪彩色增强完成，使用颜色方案: {controls['color_scheme']}")
-                
-                    # 保存到session_state
-                    st.session_state.current_image = img
-                    st.session_state.enhanced_image = enhanced_img
-                
-                    # 计算图像统计
-                    stats = processor.calculate_image_stats(img)
-                    st.session_state.image_stats = stats
-                    logger.info(f"图像统计计算完成: {stats}")
+                    controls_tuple = (
+                        controls["apply_clahe"],
+                        controls["contrast"],
+                        controls["brightness"],
+                        controls["color_scheme"],
+                    )
+                    # 文件与影响处理结果的参数都未变化时（如切换标签页、勾选显示选项），直接复用上次结果
+                    pipeline_key = (uploaded_file.file_id,) + controls_tuple
+                    if st.session_state._last_key == pipeline_key:
+                        img = st.session_state.current_image
+                        enhanced_img = st.session_state.enhanced_image
+                        stats = st.session_state.image_stats
+                        histogram = st.session_state.image_histogram
+                        download_data = st.session_state.download_data
+                    else:
+                        # 读取文件并按内容摘要与处理参数查询缓存
+                        file_bytes = uploaded_file.getvalue()
+                        file_digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+                    
+                        with st.spinner("🔄 正在处理图像..."):
+                            result = _process_cached(file_digest, uploaded_file.name, file_bytes, controls_tuple)
+                        img = result["original_image"]
+                        enhanced_img = result["enhanced_image"]
+                        stats = result["stats"]
+                        histogram = result["histogram"]
+                        download_data = result["download_data"]
+                    
+                        # 保存到session_state
+                        st.session_state.current_image = img
+                        st.session_state.enhanced_image = enhanced_img
+                        st.session_state.image_stats = stats
+                        st.session_state.image_histogram = histogram
+                        st.session_state.download_data = download_data
+                        st.session_state._last_key = pipeline_key
                 
                     # 显示结果
                     st.markdown("---")
@@ -324,20 +407,14 @@ def main():
                     ui.show_legend(legend_img)
                 
                     # 显示直方图
-                    counts = processor.compute_histogram(preprocessed_img)
-                    ui.show_histogram(counts)
+                    ui.show_histogram(histogram)
                 
                     # 输出选项
                     st.markdown("### 📥 输出选项")
                     col1, col2 = st.columns(2)
                 
                     with col1:
-                        # 下载按钮
-                        pil_img = processor.convert_to_pil(enhanced_img)
-                        download_data = ui.create_download_button(
-                            pil_img,
-                            filename=f"enhanced_{uploaded_file.name}"
-                        )
+                        # 下载按钮（JPEG字节随处理结果一起缓存，重跑时不再重新编码）
                         st.download_button(
                             label="📥 下载增强图像",
                             data=download_data,
@@ -394,11 +471,19 @@ def main():
                 st.success("数据库已初始化")
         with col_db2:
             if st.button("从数据库加载历史", use_container_width=True):
-                st.session_state.history = history_manager.load_history_from_db(APP_CONFIG["max_history_entries"])
+                # 先等待排队中的后台写入完成，确保读到刚保存的记录（写入失败在重跑后的页面顶部提示）
+                history_manager.flush()
+                st.session_state.history = deque(
+                    history_manager.load_history_from_db(APP_CONFIG["max_history_entries"]),
+                    maxlen=APP_CONFIG["max_history_entries"]
+                )
                 st.success("已从数据库加载历史")
                 st.rerun()
         with col_db3:
             if st.button("清空数据库历史", use_container_width=True):
+                # 排队中的写入若晚于清空执行，会在清空后重新写入
+                history_manager.flush()
+                _show_write_failures(history_manager)
                 history_manager.clear_history_db()
                 st.success("数据库历史已清空")
 
@@ -412,6 +497,8 @@ def main():
             end_ts = f"{filters['end_date'].strftime('%Y-%m-%d')} 23:59:59"
         do_query = st.button("查询", type="primary")
         if do_query:
+            history_manager.flush()
+            _show_write_failures(history_manager)
             records = history_manager.load_history_from_db(
                 APP_CONFIG["max_history_entries"],
                 filters={
@@ -1,12 +1,13 @@
 # modules/__init__.py
 
-from .image_processor import MedicalImageProcessor
+from .image_processor import MedicalImageProcessor, PreprocResult
 from .history_manager import HistoryManager, HistoryEntry
 from .ui_components import UIComponents
 from .config import COLOR_SCHEMES, APP_CONFIG
 
 __all__ = [
     'MedicalImageProcessor',
+    'PreprocResult',
     'HistoryManager',
     'HistoryEntry',
     'UIComponents',
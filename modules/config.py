@@ -32,6 +32,9 @@ APP_CONFIG = {
     "max_history_entries": 20,
     "allowed_file_types": ["jpg", "png", "jpeg", "bmp", "tiff"],
     "default_color_scheme": "standard",
+    "display_max_width": 800,
+    "preview_width": 512,
+    "display_jpeg_quality": 85,
     "db_enabled": True,
     "db_type": "mysql",
     "db_path": "medical_images.db",
@@ -1,18 +1,109 @@
 # modules/history_manager.py
 
+import atexit
 import datetime
 import json
+import queue
 import sqlite3
+import threading
+import time
+import warnings
+from contextlib import contextmanager
 import numpy as np
 import cv2
 import logging
+from collections import deque
+from itertools import islice
 from typing import Optional
-from typing import List, Dict, Any
-from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Deque, Iterable, Iterator, Tuple
+from dataclasses import dataclass, fields
 from io import BytesIO
 
 logger = logging.getLogger(__name__)
 
+# 可选的orjson（C实现的JSON编解码），未安装时使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_dumps(obj: Any, indent: bool = False) -> str:
+    """序列化为JSON字符串（非ASCII字符不转义）"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option).decode("utf-8")
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+
+
+def _json_loads(data: Any) -> Any:
+    """解析JSON字符串或字节"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+# 后台数据库写入队列：元素为 (HistoryManager, 记录字典列表)
+_db_queue: "queue.Queue" = queue.Queue()
+_db_worker: Optional[threading.Thread] = None
+_db_worker_lock = threading.Lock()
+
+
+# 单次合并提交的最大记录数
+_DB_BATCH_MAX = 500
+
+
+def _db_worker_loop():
+    """后台线程：取出待写入的记录并批量保存到数据库
+
+    空闲时收到的记录立即写入；写入期间积压的请求在下一轮一并取出，
+    按管理器合并后用一次事务提交，突发写入时减少提交与fsync次数。
+    """
+    while True:
+        batches = [_db_queue.get()]
+        total = len(batches[0][1])
+        while total < _DB_BATCH_MAX:
+            try:
+                item = _db_queue.get_nowait()
+            except queue.Empty:
+                break
+            batches.append(item)
+            total += len(item[1])
+        
+        grouped: Dict[int, tuple] = {}
+        for manager, entries in batches:
+            grouped.setdefault(id(manager), (manager, []))[1].extend(entries)
+        try:
+            for manager, entries in grouped.values():
+                try:
+                    manager.save_entries_to_db_bulk(entries)
+                    logger.debug(f"后台保存历史记录完成，共 {len(entries)} 条")
+                except Exception as e:
+                    logger.error(f"后台保存历史记录失败: {e}", exc_info=True)
+                    manager._record_write_failure(len(entries), e)
+        finally:
+            for _ in batches:
+                _db_queue.task_done()
+
+
+def _ensure_db_worker():
+    """首次使用时启动后台写入线程"""
+    global _db_worker
+    with _db_worker_lock:
+        if _db_worker is None or not _db_worker.is_alive():
+            _db_worker = threading.Thread(target=_db_worker_loop, name="history-db-writer", daemon=True)
+            _db_worker.start()
+
+
+def flush_db_queue():
+    """等待所有排队中的数据库写入完成"""
+    if _db_worker is not None and _db_worker.is_alive():
+        _db_queue.join()
+
+
+# 进程退出前把尚未写入的记录落库
+atexit.register(flush_db_queue)
 
 
 @dataclass
@@ -24,108 +115,202 @@ class HistoryEntry:
     stats: Dict[str, Any]
     original_shape: tuple
     enhanced_shape: tuple
+    timestamp_ts: Optional[int] = None  # Unix时间戳（秒），用于数据库范围查询
     
     def to_dict(self) -> Dict[str, Any]:
-        """转换为字典"""
-        return asdict(self)
+        """转换为字典（字段均为浅层值，直接构造，避免asdict的反射与深拷贝）"""
+        return {
+            "timestamp": self.timestamp,
+            "filename": self.filename,
+            "color_scheme": self.color_scheme,
+            "stats": self.stats,
+            "original_shape": self.original_shape,
+            "enhanced_shape": self.enhanced_shape,
+            "timestamp_ts": self.timestamp_ts,
+        }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'HistoryEntry':
-        """从字典创建实例"""
-        return cls(**data)
+        """从字典创建实例（忽略数据库记录中的id等非字段键）"""
+        names = {f.name for f in fields(cls)}
+        return cls(**{k: v for k, v in data.items() if k in names})
 
 
 class HistoryManager:
     """历史记录管理器"""
     
-    def __init__(self, max_entries: int = 20, db_enabled: bool = False, db_path: str = "medical_images.db", db_type: str = "sqlite", mysql_config: Optional[Dict[str, Any]] = None):
+    # SQL语句预先定义为常量（SQLite与MySQL只有占位符不同），SQL文本固定，便于驱动复用已编译的语句
+    _INSERT_COLUMNS = "timestamp, filename, color_scheme, stats_json, original_width, original_height, enhanced_width, enhanced_height, timestamp_ts"
+    _INSERT_SQL_SQLITE = f"INSERT INTO history ({_INSERT_COLUMNS}) VALUES ({', '.join(['?'] * 9)})"
+    _INSERT_SQL_MYSQL = f"INSERT INTO history ({_INSERT_COLUMNS}) VALUES ({', '.join(['%s'] * 9)})"
+    _SELECT_SQL = "SELECT id, timestamp, filename, color_scheme, stats_json, original_width, original_height, enhanced_width, enhanced_height, timestamp_ts FROM history"
+    _COUNT_SQL = "SELECT COUNT(*) FROM history"
+    
+    def __init__(self, max_entries: int = 20, db_enabled: bool = False, db_path: str = "medical_images.db", db_type: str = "sqlite", mysql_config: Optional[Dict[str, Any]] = None, sqlite_pool_size: int = 5):
         self.max_entries = max_entries
         self.db_enabled = db_enabled
         self.db_path = db_path
         self.db_type = db_type
         self.mysql_config = mysql_config or {}
         self._mysql_pool = None  # MySQL连接池
-        # 不再使用持久化的SQLite连接，每次操作都创建新连接
+        self._mysql_cfg = self._build_mysql_cfg()
+        # SQLite连接池：空闲连接放回队列复用；在此创建并只在配置切换时替换，避免多个线程各自创建
+        self._sqlite_pool_size = sqlite_pool_size
+        self._sqlite_pool: "queue.Queue" = queue.Queue(maxsize=sqlite_pool_size)
+        # 记录数缓存：筛选条件 -> (数量, 缓存时间)，写入或清空时失效
+        self._count_cache: Dict[tuple, tuple] = {}
+        self._count_ttl = 2.0
+        # 当前数据库是否已完成表结构迁移（首次取连接时检查一次，配置切换后重新检查）
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        # 后台写入失败的记录数与最近一次错误，由界面通过pop_write_failures取出并提示
+        self._write_failures = 0
+        self._last_write_error: Optional[str] = None
+        self._write_error_lock = threading.Lock()
 
     def set_db_config(self, enabled: bool, db_type: str, path: str, mysql_config: Optional[Dict[str, Any]] = None):
+        # 数据库文件或类型变化时，旧的SQLite连接不能再复用
+        if path != self.db_path or db_type != self.db_type:
+            self._close_sqlite_pool()
+            self._count_cache.clear()
+            self._schema_ready = False
         self.db_enabled = enabled
         self.db_type = db_type
         self.db_path = path
         if mysql_config:
             self.mysql_config = mysql_config
-        # 重置MySQL连接池
-        self._mysql_pool = None
+        # 仅在连接参数变化时重置MySQL连接池，避免每次页面重跑都重建连接池
+        mysql_cfg = self._build_mysql_cfg()
+        if mysql_cfg != self._mysql_cfg:
+            self._mysql_cfg = mysql_cfg
+            self._mysql_pool = None
+            self._schema_ready = False
 
-    def _get_conn(self, db_name: Optional[str] = None):
-        if self.db_type == "mysql":
-            import mysql.connector.pooling
-            if self._mysql_pool is None:
-                # 创建MySQL连接池
-                cfg = {
-                    "host": self.mysql_config.get("host", "localhost"),
-                    "port": int(self.mysql_config.get("port", 3306)),
-                    "user": self.mysql_config.get("user", "root"),
-                    "password": self.mysql_config.get("password", "liu123"),
-                    "charset": "utf8mb4",
-                    "connect_timeout": 10
-                }
-                if not db_name and self.mysql_config.get("database"):
-                    cfg["database"] = self.mysql_config.get("database")
-                elif db_name:
-                    cfg["database"] = db_name
-                
-                try:
-                    self._mysql_pool = mysql.connector.pooling.MySQLConnectionPool(
-                        pool_name="medical_images_pool",
-                        pool_size=5,
-                        pool_reset_session=True,
-                        **cfg
-                    )
-                    logger.info("MySQL连接池创建成功")
-                except Exception as e:
-                    logger.error(f"创建MySQL连接池失败: {e}")
-                    # 失败时返回单个连接
-                    try:
-                        return mysql.connector.connect(**cfg)
-                    except Exception as ex:
-                        logger.error(f"创建单个MySQL连接失败: {ex}")
-                        raise
-            
+    def _close_sqlite_pool(self):
+        """换用新的空连接池，并关闭旧连接池中所有空闲的SQLite连接"""
+        pool, self._sqlite_pool = self._sqlite_pool, queue.Queue(maxsize=self._sqlite_pool_size)
+        while True:
             try:
-                conn = self._mysql_pool.get_connection()
-                logger.debug("从连接池获取MySQL连接成功")
-                return conn
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
             except Exception as e:
-                logger.error(f"从连接池获取MySQL连接失败: {e}")
-                # 连接池获取失败时创建新连接
-                cfg = {
-                    "host": self.mysql_config.get("host", "localhost"),
-                    "port": int(self.mysql_config.get("port", 3306)),
-                    "user": self.mysql_config.get("user", "root"),
-                    "password": self.mysql_config.get("password", "liu123"),
-                    "charset": "utf8mb4",
-                    "connect_timeout": 10
-                }
+                logger.warning(f"关闭SQLite连接失败: {e}")
+
+    def _build_mysql_cfg(self) -> Dict[str, Any]:
+        """根据mysql_config生成连接参数"""
+        cfg = {
+            "host": self.mysql_config.get("host", "localhost"),
+            "port": int(self.mysql_config.get("port", 3306)),
+            "user": self.mysql_config.get("user", "root"),
+            "password": self.mysql_config.get("password", "liu123"),
+            "charset": "utf8mb4",
+            "connect_timeout": 10
+        }
+        if self.mysql_config.get("database"):
+            cfg["database"] = self.mysql_config.get("database")
+        return cfg
+
+    def _init_mysql_pool(self):
+        """创建MySQL连接池"""
+        import mysql.connector.pooling
+        try:
+            self._mysql_pool = mysql.connector.pooling.MySQLConnectionPool(
+                pool_name="medical_images_pool",
+                pool_size=5,
+                pool_reset_session=True,
+                **self._mysql_cfg
+            )
+            logger.info("MySQL连接池创建成功")
+        except Exception as e:
+            logger.error(f"创建MySQL连接池失败: {e}")
+            raise
+
+    def _get_conn(self, db_name: Optional[str] = None):
+        if self.db_type == "mysql":
+            if db_name is not None:
+                # 显式指定数据库（如建库时不带数据库）使用独立连接，不影响连接池的配置
+                import mysql.connector
+                cfg = dict(self._mysql_cfg)
+                cfg.pop("database", None)
                 if db_name:
                     cfg["database"] = db_name
-                elif self.mysql_config.get("database"):
-                    cfg["database"] = self.mysql_config.get("database")
-                
-                try:
-                    return mysql.connector.connect(**cfg)
-                except Exception as ex:
-                    logger.error(f"创建单个MySQL连接失败: {ex}")
-                    raise
+                return mysql.connector.connect(**cfg)
+            if self._mysql_pool is None:
+                self._init_mysql_pool()
+            return self._mysql_pool.get_connection()
         
-        # SQLite连接 - 每次都创建新连接，不再使用持久化连接
+        # SQLite连接 - 优先复用连接池中的空闲连接
         try:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._sqlite_pool.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            # 连接会被连接池长期复用，扩大语句缓存，让常用查询无需重复解析
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+            # synchronous等设置只对当前连接有效，新建连接时设置一次
+            # WAL模式下synchronous=NORMAL每次提交只需一次fsync
+            # auto_vacuum与journal_mode会持久化到数据库文件，新建连接时设置一次，已有数据库无需初始化也会切换到WAL
+            # （auto_vacuum只对尚未建表的新数据库生效，须在切换WAL之前设置；内存数据库不支持WAL）
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            if self.db_path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-20000")
             logger.debug("创建SQLite连接成功")
             return conn
         except Exception as e:
             logger.error(f"创建SQLite连接失败: {e}")
             raise
 
+    def _release_conn(self, conn, pool: Optional["queue.Queue"] = None):
+        """归还连接：SQLite连接放回连接池（池满或连接池已因配置切换被替换时关闭），MySQL连接交还给其连接池"""
+        if isinstance(conn, sqlite3.Connection) and pool is self._sqlite_pool:
+            try:
+                # 不把未结束的事务带回连接池
+                if conn.in_transaction:
+                    conn.rollback()
+                pool.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+            except sqlite3.Error as e:
+                logger.warning(f"归还SQLite连接失败: {e}")
+        conn.close()
+
+    @contextmanager
+    def _conn_ctx(self) -> Iterator[Any]:
+        """获取数据库连接，退出时自动归还"""
+        # 记录取连接时所属的连接池，配置切换后归还的旧连接会被直接关闭
+        pool = self._sqlite_pool if self.db_type != "mysql" else None
+        conn = self._get_conn()
+        try:
+            self._ensure_schema(conn)
+            yield conn
+        finally:
+            self._release_conn(conn, pool)
+
+    def _ensure_schema(self, conn):
+        """旧版数据库（history表缺少timestamp_ts列）在首次取连接时自动迁移，无需先执行init_db"""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            cur = conn.cursor()
+            if self.db_type == "mysql":
+                cur.execute("SHOW TABLES LIKE 'history'")
+            else:
+                cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='history'")
+            if not cur.fetchall():
+                # 尚未建表，由init_db创建（新表已包含timestamp_ts列）
+                return
+            self._migrate_schema(cur)
+            self._create_indexes(cur)
+            conn.commit()
+            self._schema_ready = True
+
     def init_db(self):
         if self.db_type == "mysql":
             try:
@@ -143,8 +328,7 @@ class HistoryManager:
             except Exception as e:
                 print(f"Error connecting to MySQL: {e}")    
         
-        conn = self._get_conn()
-        try:
+        with self._conn_ctx() as conn:
             cur = conn.cursor()
             if self.db_type == "mysql":
                 cur.execute(
@@ -158,7 +342,8 @@ class HistoryManager:
                         original_width INT,
                         original_height INT,
                         enhanced_width INT,
-                        enhanced_height INT
+                        enhanced_height INT,
+                        timestamp_ts BIGINT
                     )
                     """
                 )
@@ -174,19 +359,67 @@ class HistoryManager:
                         original_width INTEGER,
                         original_height INTEGER,
                         enhanced_width INTEGER,
-                        enhanced_height INTEGER
+                        enhanced_height INTEGER,
+                        timestamp_ts INTEGER
                     )
                     """
                 )
+            self._migrate_schema(cur)
+            self._create_indexes(cur)
             conn.commit()
-        finally:
-            conn.close()
+        self._schema_ready = True
+    
+    def _migrate_schema(self, cur):
+        """为旧版数据库补充timestamp_ts列，并回填已有记录的时间戳"""
+        if self.db_type == "mysql":
+            try:
+                cur.execute("ALTER TABLE history ADD COLUMN timestamp_ts BIGINT")
+            except Exception as e:
+                # 1060: 列已存在
+                if getattr(e, "errno", None) != 1060:
+                    raise
+        else:
+            cur.execute("PRAGMA table_info(history)")
+            if "timestamp_ts" not in {row[1] for row in cur.fetchall()}:
+                cur.execute("ALTER TABLE history ADD COLUMN timestamp_ts INTEGER")
+        
+        cur.execute("SELECT id, timestamp FROM history WHERE timestamp_ts IS NULL")
+        updates = []
+        for row_id, timestamp in cur.fetchall():
+            ts = self._to_epoch(timestamp)
+            if ts is not None:
+                updates.append((ts, row_id))
+        if updates:
+            placeholder = self._placeholder
+            cur.executemany(f"UPDATE history SET timestamp_ts = {placeholder} WHERE id = {placeholder}", updates)
+            logger.info(f"已回填 {len(updates)} 条历史记录的时间戳")
     
-    def add_entry(self, history_list: List[Dict], entry_data: Dict) -> List[Dict]:
+    # 查询筛选用到的索引：按颜色方案+时间范围筛选、按时间范围筛选
+    _HISTORY_INDEXES = (
+        ("idx_history_scheme_ts", "color_scheme, timestamp_ts DESC"),
+        ("idx_history_ts", "timestamp_ts DESC"),
+    )
+
+    def _create_indexes(self, cur):
+        """为history表创建筛选列索引（已存在则跳过）"""
+        for name, columns in self._HISTORY_INDEXES:
+            if self.db_type == "mysql":
+                # MySQL不支持CREATE INDEX IF NOT EXISTS，重复创建时忽略"索引已存在"错误
+                try:
+                    cur.execute(f"CREATE INDEX {name} ON history ({columns})")
+                except Exception as e:
+                    if getattr(e, "errno", None) != 1061:
+                        raise
+            else:
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON history ({columns})")
+    
+    def add_entry(self, history_list: Iterable[Dict], entry_data: Dict) -> Deque[Dict]:
         """添加新的历史记录"""
-        # 创建历史记录条目
+        # 创建历史记录条目（显示用的时间字符串与查询用的时间戳取自同一时刻）
+        now = datetime.datetime.now()
         entry = HistoryEntry(
-            timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            timestamp=now.strftime("%Y-%m-%d %H:%M:%S"),
+            timestamp_ts=int(now.timestamp()),
             filename=entry_data.get("filename", "unknown"),
             color_scheme=entry_data.get("color_scheme", "标准"),
             stats=entry_data.get("stats", {}),
@@ -194,64 +427,163 @@ class HistoryManager:
             enhanced_shape=entry_data.get("enhanced_shape", (0, 0))
         )
         
-        # 添加到列表开头
-        history_list.insert(0, entry.to_dict())
+        # 添加到队列开头，maxlen会自动淘汰超出数量的旧记录
+        if not isinstance(history_list, deque):
+            history_list = deque(history_list, maxlen=self.max_entries)
+        entry_dict = entry.to_dict()
+        history_list.appendleft(entry_dict)
         
         if self.db_enabled:
-            self.save_entry_to_db(entry)
-        
-        # 限制记录数量
-        if len(history_list) > self.max_entries:
-            history_list = history_list[:self.max_entries]
+            self.save_entries_async([entry_dict])
         
         return history_list
     
+    @property
+    def _placeholder(self) -> str:
+        return "%s" if self.db_type == "mysql" else "?"
+    
+    @property
+    def _insert_sql(self) -> str:
+        return self._INSERT_SQL_MYSQL if self.db_type == "mysql" else self._INSERT_SQL_SQLITE
+    
+    def _filter_clause(self, filters: Optional[Dict[str, Any]], after_id: Optional[int] = None) -> tuple:
+        """根据筛选条件生成WHERE子句及参数列表"""
+        placeholder = self._placeholder
+        where = []
+        params: List[Any] = []
+        if after_id is not None:
+            where.append(f"id < {placeholder}")
+            params.append(int(after_id))
+        if filters:
+            if filters.get("filename_contains"):
+                where.append(f"filename LIKE {placeholder}")
+                params.append(f"%{filters['filename_contains']}%")
+            if filters.get("color_scheme") and filters["color_scheme"] != "全部":
+                where.append(f"color_scheme = {placeholder}")
+                params.append(filters["color_scheme"])
+            # 时间范围按整数时间戳比较；无法解析的值仍按字符串比较
+            for key, op in (("start_ts", ">="), ("end_ts", "<=")):
+                value = filters.get(key)
+                if not value:
+                    continue
+                epoch = self._to_epoch(value)
+                if epoch is not None:
+                    where.append(f"timestamp_ts {op} {placeholder}")
+                    params.append(epoch)
+                else:
+                    where.append(f"timestamp {op} {placeholder}")
+                    params.append(value)
+        return (" WHERE " + " AND ".join(where) if where else ""), params
+    
+    @staticmethod
+    def _to_epoch(value: Any) -> Optional[int]:
+        """将时间字符串、日期或时间戳转换为Unix时间戳（秒，按本地时间），无法解析时返回None"""
+        if value is None or value == "":
+            return None
+        if isinstance(value, (int, float)):
+            return int(value)
+        if isinstance(value, datetime.datetime):
+            return int(value.timestamp())
+        if isinstance(value, datetime.date):
+            return int(datetime.datetime.combine(value, datetime.time()).timestamp())
+        try:
+            return int(datetime.datetime.fromisoformat(str(value)).timestamp())
+        except ValueError:
+            return None
+    
+    @staticmethod
+    def _entry_row(timestamp: str, filename: str, color_scheme: str, stats: Dict[str, Any],
+                   original_shape: tuple, enhanced_shape: tuple, timestamp_ts: Optional[int] = None) -> tuple:
+        """将一条历史记录转换为INSERT参数元组"""
+        stats_json = _json_dumps(stats)
+        oh, ow = original_shape[:2] if len(original_shape) >= 2 else (0, 0)
+        eh, ew = enhanced_shape[:2] if len(enhanced_shape) >= 2 else (0, 0)
+        if timestamp_ts is None:
+            timestamp_ts = HistoryManager._to_epoch(timestamp)
+        return (timestamp, filename, color_scheme, stats_json, int(ow), int(oh), int(ew), int(eh), timestamp_ts)
+    
+    def _insert_rows(self, rows: List[tuple]):
+        """在单个事务中批量插入历史记录行"""
+        with self._conn_ctx() as conn:
+            cur = conn.cursor()
+            # 执行批量插入
+            cur.executemany(self._insert_sql, rows)
+            conn.commit()
+        self._count_cache.clear()
+    
     def save_entries_to_db(self, entries: List[HistoryEntry]):
         """批量保存历史记录到数据库"""
         if not entries:
             return
         
-        conn = self._get_conn()
-        try:
-            cur = conn.cursor()
-            placeholder = "%s" if self.db_type == "mysql" else "?"
-            sql = f"INSERT INTO history (timestamp, filename, color_scheme, stats_json, original_width, original_height, enhanced_width, enhanced_height) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})"
-            
-            # 准备批量插入的数据
-            data = []
-            for entry in entries:
-                stats_json = json.dumps(entry.stats, ensure_ascii=False)
-                oh, ow = entry.original_shape[:2] if len(entry.original_shape) >= 2 else (0, 0)
-                eh, ew = entry.enhanced_shape[:2] if len(entry.enhanced_shape) >= 2 else (0, 0)
-                data.append((entry.timestamp, entry.filename, entry.color_scheme, stats_json, int(ow), int(oh), int(ew), int(eh)))
-            
-            # 执行批量插入
-            cur.executemany(sql, data)
-            conn.commit()
-        finally:
-            conn.close()
+        self._insert_rows([
+            self._entry_row(e.timestamp, e.filename, e.color_scheme, e.stats, e.original_shape, e.enhanced_shape, e.timestamp_ts)
+            for e in entries
+        ])
+    
+    def save_entries_to_db_bulk(self, entries: List[Dict[str, Any]]):
+        """直接从字典列表批量保存历史记录，无需构造HistoryEntry"""
+        if not entries:
+            return
+        
+        self._insert_rows([
+            self._entry_row(
+                e.get("timestamp", ""),
+                e.get("filename", "unknown"),
+                e.get("color_scheme", "标准"),
+                e.get("stats", {}),
+                e.get("original_shape", (0, 0)),
+                e.get("enhanced_shape", (0, 0)),
+                e.get("timestamp_ts"),
+            )
+            for e in entries
+        ])
     
-    def clear_history(self) -> List:
+    def save_entries_async(self, entries: List[Dict[str, Any]]):
+        """将记录交给后台线程写入数据库，调用方无需等待提交完成"""
+        if not entries:
+            return
+        _ensure_db_worker()
+        _db_queue.put((self, list(entries)))
+    
+    def flush(self):
+        """等待已提交给后台线程的记录全部写入数据库"""
+        flush_db_queue()
+    
+    def _record_write_failure(self, count: int, error: Exception):
+        """记录后台写入失败（在写入线程中调用）"""
+        with self._write_error_lock:
+            self._write_failures += count
+            self._last_write_error = str(error)
+    
+    def pop_write_failures(self) -> Tuple[int, Optional[str]]:
+        """取出并清零自上次调用以来后台写入失败的记录数与最近一次错误信息"""
+        with self._write_error_lock:
+            failures, error = self._write_failures, self._last_write_error
+            self._write_failures = 0
+            self._last_write_error = None
+        return failures, error
+    
+    def clear_history(self) -> Deque[Dict]:
         """清空历史记录"""
-        return []
+        return deque(maxlen=self.max_entries)
     
-    def get_recent_entries(self, history_list: List[Dict], count: int = 5) -> List[Dict]:
+    def get_recent_entries(self, history_list: Iterable[Dict], count: int = 5) -> List[Dict]:
         """获取最近的记录"""
-        return history_list[:count]
+        return list(islice(history_list, count))
     
-    def export_to_json(self, history_list: List[Dict]) -> str:
+    def export_to_json(self, history_list: Iterable[Dict]) -> str:
         """导出历史记录为JSON"""
-        return json.dumps(history_list, indent=2, ensure_ascii=False)
+        return _json_dumps(list(history_list), indent=True)
     
     def import_from_json(self, json_str: str) -> List[Dict]:
         """从JSON导入历史记录"""
-        return json.loads(json_str)
+        return _json_loads(json_str)
 
     def save_entry_to_db(self, entry: HistoryEntry):
-        conn = self._get_conn()
-        try:
+        with self._conn_ctx() as conn:
             cur = conn.cursor()
-            stats_json = json.dumps(entry.stats, ensure_ascii=False)
+            stats_json = _json_dumps(entry.stats)
             ow = 0
             oh = 0
             ew = 0
@@ -264,9 +596,7 @@ class HistoryManager:
                 if len(entry.enhanced_shape) >= 2:
                     eh = int(entry.enhanced_shape[0])
                     ew = int(entry.enhanced_shape[1])
-            placeholder = "%s" if self.db_type == "mysql" else "?"
-            sql = f"INSERT INTO history (timestamp, filename, color_scheme, stats_json, original_width, original_height, enhanced_width, enhanced_height) VALUES ({placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder}, {placeholder})"
-            cur.execute(sql, (
+            cur.execute(self._insert_sql, (
                 entry.timestamp,
                 entry.filename,
                 entry.color_scheme,
@@ -275,106 +605,88 @@ class HistoryManager:
                 oh,
                 ew,
                 eh,
+                entry.timestamp_ts if entry.timestamp_ts is not None else self._to_epoch(entry.timestamp),
             ))
             conn.commit()
-        finally:
-            conn.close()
+        self._count_cache.clear()
 
-    def load_history_from_db(self, limit: Optional[int] = None, filters: Optional[Dict[str, Any]] = None, page: int = 1, page_size: int = 10) -> List[Dict]:
-        """从数据库加载历史记录，支持分页"""
-        conn = self._get_conn()
+    @staticmethod
+    def _loads_stats(stats_json: Optional[str]) -> Dict[str, Any]:
+        """解析统计信息JSON，内容为空或损坏时返回空字典"""
+        if not stats_json:
+            return {}
         try:
+            return _json_loads(stats_json)
+        except Exception:
+            return {}
+
+    def load_history_from_db(self, limit: Optional[int] = None, filters: Optional[Dict[str, Any]] = None, page: int = 1, page_size: int = 10, *, after_id: Optional[int] = None) -> List[Dict]:
+        """从数据库加载历史记录，支持分页
+
+        采用键集分页：传入上一页最后一条记录的id作为after_id获取下一页，
+        数据库直接按主键定位，不必像OFFSET那样扫描并丢弃前面的行。
+        page参数已弃用，仅为兼容旧调用保留（page>1时仍按OFFSET分页）。
+        """
+        if page and page > 1:
+            warnings.warn("load_history_from_db的page参数已弃用，请改用after_id", DeprecationWarning, stacklevel=2)
+        with self._conn_ctx() as conn:
             cur = conn.cursor()
-            placeholder = "%s" if self.db_type == "mysql" else "?"
-            q = "SELECT timestamp, filename, color_scheme, stats_json, original_width, original_height, enhanced_width, enhanced_height FROM history"
-            where = []
-            params: List[Any] = []
-            if filters:
-                if filters.get("filename_contains"):
-                    where.append(f"filename LIKE {placeholder}")
-                    params.append(f"%{filters['filename_contains']}%")
-                if filters.get("color_scheme") and filters["color_scheme"] != "全部":
-                    where.append(f"color_scheme = {placeholder}")
-                    params.append(filters["color_scheme"])
-                if filters.get("start_ts"):
-                    where.append(f"timestamp >= {placeholder}")
-                    params.append(filters["start_ts"])
-                if filters.get("end_ts"):
-                    where.append(f"timestamp <= {placeholder}")
-                    params.append(filters["end_ts"])
-            if where:
-                q += " WHERE " + " AND ".join(where)
-            q += " ORDER BY id DESC"
+            where, params = self._filter_clause(filters, after_id)
+            q = self._SELECT_SQL + where + " ORDER BY id DESC"
             
-            # 实现分页
-            if page and page_size:
-                offset = (page - 1) * page_size
-                if self.db_type == "mysql":
-                    q += f" LIMIT {page_size} OFFSET {offset}"
-                else:  # SQLite
-                    q += f" LIMIT {page_size} OFFSET {offset}"
+            # 实现分页（LIMIT同样作为参数绑定，保持SQL文本不变）
+            if page_size:
+                q += f" LIMIT {self._placeholder}"
+                params.append(int(page_size))
+                if page and page > 1 and after_id is None:
+                    q += f" OFFSET {self._placeholder}"
+                    params.append((int(page) - 1) * int(page_size))
             elif limit and isinstance(limit, int):
-                q += f" LIMIT {limit}"
+                q += f" LIMIT {self._placeholder}"
+                params.append(limit)
             
             cur.execute(q, tuple(params))
             rows = cur.fetchall()
-            result: List[Dict[str, Any]] = []
-            for r in rows:
-                stats = {}
-                try:
-                    stats = json.loads(r[3]) if r[3] else {}
-                except Exception:
-                    stats = {}
-                result.append(
-                    HistoryEntry(
-                        timestamp=r[0],
-                        filename=r[1],
-                        color_scheme=r[2],
-                        stats=stats,
-                        original_shape=(int(r[5]), int(r[4])),
-                        enhanced_shape=(int(r[7]), int(r[6])),
-                    ).to_dict()
-                )
-            return result
-        finally:
-            conn.close()
+            loads_stats = self._loads_stats
+            return [
+                {
+                    "id": r[0],
+                    "timestamp": r[1],
+                    "filename": r[2],
+                    "color_scheme": r[3],
+                    "stats": loads_stats(r[4]),
+                    "original_shape": (int(r[6]), int(r[5])),
+                    "enhanced_shape": (int(r[8]), int(r[7])),
+                    "timestamp_ts": r[9],
+                }
+                for r in rows
+            ]
     
     def count_history_entries(self, filters: Optional[Dict[str, Any]] = None) -> int:
-        """统计符合条件的历史记录数量"""
-        conn = self._get_conn()
-        try:
+        """统计符合条件的历史记录数量（短时间内相同筛选条件复用上次结果）"""
+        key = tuple(sorted((k, v) for k, v in (filters or {}).items() if v))
+        cached = self._count_cache.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self._count_ttl:
+            return cached[0]
+        
+        with self._conn_ctx() as conn:
             cur = conn.cursor()
-            placeholder = "%s" if self.db_type == "mysql" else "?"
-            q = "SELECT COUNT(*) FROM history"
-            where = []
-            params: List[Any] = []
-            if filters:
-                if filters.get("filename_contains"):
-                    where.append(f"filename LIKE {placeholder}")
-                    params.append(f"%{filters['filename_contains']}%")
-                if filters.get("color_scheme") and filters["color_scheme"] != "全部":
-                    where.append(f"color_scheme = {placeholder}")
-                    params.append(filters["color_scheme"])
-                if filters.get("start_ts"):
-                    where.append(f"timestamp >= {placeholder}")
-                    params.append(filters["start_ts"])
-                if filters.get("end_ts"):
-                    where.append(f"timestamp <= {placeholder}")
-                    params.append(filters["end_ts"])
-            if where:
-                q += " WHERE " + " AND ".join(where)
+            where, params = self._filter_clause(filters)
+            q = self._COUNT_SQL + where
             
             cur.execute(q, tuple(params))
             count = cur.fetchone()[0]
-            return int(count) if count else 0
-        finally:
-            conn.close()
+            count = int(count) if count else 0
+        self._count_cache[key] = (count, time.monotonic())
+        return count
 
     def clear_history_db(self):
-        conn = self._get_conn()
-        try:
+        with self._conn_ctx() as conn:
             cur = conn.cursor()
             cur.execute("DELETE FROM history")
             conn.commit()
-        finally:
-            conn.close()
+            if self.db_type != "mysql":
+                # 回收删除后的空闲页（auto_vacuum=INCREMENTAL由_get_conn设置，旧数据库上为空操作）；
+                # execute只单步执行该PRAGMA、每次只释放一页，executescript会执行到结束
+                conn.executescript("PRAGMA incremental_vacuum;")
+        self._count_cache.clear()
@@ -3,51 +3,263 @@
 import cv2
 import numpy as np
 import logging
-from typing import Dict, Tuple, Any
+import threading
+from dataclasses import dataclass
+from typing import Dict, Tuple, Any, List, Optional
 from functools import lru_cache
 from .config import COLOR_SCHEMES
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+# 可选的GPU批量解码（nvImageCodec），不可用时回退到cv2.imdecode
+# cv2.imdecode(IMREAD_UNCHANGED)不按EXIF方向旋转，GPU解码同样关闭该选项
+try:
+    from nvidia import nvimgcodec
+    _nvimgcodec_decoder = nvimgcodec.Decoder()
+    _nvimgcodec_params = nvimgcodec.DecodeParams(apply_exif_orientation=False)
+except Exception:
+    nvimgcodec = None
+    _nvimgcodec_decoder = None
+    _nvimgcodec_params = None
+
+# 可选的Numba并行查表内核，仅用于超大图像，未安装时使用cv2.LUT
+try:
+    import numba
+
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _apply_color_lut(gray, lut, out):
+        height, width = gray.shape
+        for i in numba.prange(height):
+            for j in range(width):
+                c = gray[i, j]
+                out[i, j, 0] = lut[c, 0]
+                out[i, j, 1] = lut[c, 1]
+                out[i, j, 2] = lut[c, 2]
+        return out
+
+    # 导入时用小图预热一次，提前完成JIT编译
+    _apply_color_lut(np.zeros((1, 1), np.uint8), np.zeros((256, 3), np.uint8), np.empty((1, 1, 3), np.uint8))
+    # 每个Streamlit会话在各自的线程中运行脚本，内核可能被并发调用；
+    # workqueue线程层（缺少OpenMP/TBB时的回退）不支持并发调用，会直接终止进程，此时改用cv2.LUT
+    if numba.threading_layer() == "workqueue":
+        logger.info("Numba线程层为workqueue，不支持并发调用，伪彩色查表使用cv2.LUT")
+        _apply_color_lut = None
+except Exception:
+    numba = None
+    _apply_color_lut = None
+
+# 可选的simplejpeg（libjpeg-turbo的轻量封装），用于JPEG编码，未安装时使用cv2.imencode
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# 像素数超过该值时才使用Numba内核（小图上线程调度开销大于收益）
+_NUMBA_MIN_PIXELS = 2_000_000
+
+# 非精确统计时，像素数超过该值的图像按步长隔行隔列抽样计算均值/标准差/中位数
+_STATS_SAMPLE_MIN_PIXELS = 4_000_000
+_STATS_SAMPLE_STEP = 4
+
+
+def _build_layer_tables(layers) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """将分层配置转换为(下限, 上限, BGR颜色)三个数组（配置中的颜色为RGB）"""
+    mins = np.array([layer[0] for layer in layers], dtype=np.int16)
+    maxs = np.array([layer[1] for layer in layers], dtype=np.int16)
+    colors = np.array([layer[2] for layer in layers], dtype=np.uint8).reshape(-1, 3)[:, ::-1]
+    return mins, maxs, np.ascontiguousarray(colors)
+
+
+def _build_color_lut(tables: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> np.ndarray:
+    """根据分层数组构建256级BGR颜色查找表（区间重叠时后面的分层优先，未覆盖的灰度为黑色）"""
+    mins, maxs, colors = tables
+    levels = np.arange(256, dtype=np.int16)
+    # 每个分层对每个灰度级是否命中，形状为(分层数, 256)
+    hits = (levels >= mins[:, np.newaxis]) & (levels < maxs[:, np.newaxis])
+    last_hit = len(mins) - 1 - np.argmax(hits[::-1], axis=0)
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    covered = hits.any(axis=0)
+    lut[covered] = colors[last_hit[covered]]
+    return lut
+
+
+@lru_cache(maxsize=64)
+def _build_scale_lut(contrast: float, brightness: int) -> np.ndarray:
+    """构建对比度/亮度调整的256级查找表（与cv2.convertScaleAbs结果一致）"""
+    levels = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    return cv2.convertScaleAbs(levels, alpha=contrast, beta=brightness)
+
+
+@dataclass
+class PreprocResult:
+    """预处理与分析结果数据类"""
+    image: np.ndarray
+    histogram: np.ndarray
+    stats: Dict[str, float]
+
+
 class MedicalImageProcessor:
     """医学图像处理核心类"""
     
     # 缓存CLAHE对象，避免重复创建
-    _clahe_cache = {}
+    # CLAHE对象内部持有临时缓冲区，不能跨线程共享，因此按线程缓存
+    _clahe_local = threading.local()
+    
+    # 按线程缓存的临时缓冲区，批量处理时在多张图像之间复用
+    _scratch_local = threading.local()
+    
+    # 各颜色方案的分层数组与查找表在导入时预先计算一次
+    _layer_tables = {name: _build_layer_tables(layers) for name, layers in COLOR_SCHEMES.items()}
+    _color_luts = {name: _build_color_lut(tables) for name, tables in _layer_tables.items()}
+    # 按通道拆分的连续查找表，供cv2.LUT逐通道SIMD查表
+    _channel_luts = {
+        name: tuple(np.ascontiguousarray(lut[:, c]) for c in range(3))
+        for name, lut in _color_luts.items()
+    }
+    
+    # 图例同样只依赖颜色方案，导入时预先渲染；设为只读，防止调用方修改共享的缓存数组
+    _legend_cache = {name: np.repeat(lut[np.newaxis], 40, axis=0) for name, lut in _color_luts.items()}
+    for _legend in _legend_cache.values():
+        _legend.setflags(write=False)
+    del _legend
     
     @staticmethod
     def _get_clahe(clip_limit: float = 2.0, tile_grid_size: tuple = (8, 8)) -> cv2.CLAHE:
-        """获取或创建CLAHE对象"""
+        """获取或创建当前线程的CLAHE对象"""
+        cache = getattr(MedicalImageProcessor._clahe_local, "cache", None)
+        if cache is None:
+            cache = MedicalImageProcessor._clahe_local.cache = {}
         cache_key = (clip_limit, tile_grid_size)
-        if cache_key not in MedicalImageProcessor._clahe_cache:
-            MedicalImageProcessor._clahe_cache[cache_key] = cv2.createCLAHE(
+        if cache_key not in cache:
+            cache[cache_key] = cv2.createCLAHE(
                 clipLimit=clip_limit, 
                 tileGridSize=tile_grid_size
             )
-        return MedicalImageProcessor._clahe_cache[cache_key]
+        return cache[cache_key]
+    
+    @staticmethod
+    def decode_image(data: bytes) -> Optional[np.ndarray]:
+        """使用OpenCV解码图像字节，失败时返回None"""
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    
+    @staticmethod
+    def _is_color_jpeg8(data: bytes) -> bool:
+        """判断是否为8位3通道的基线/扩展/渐进式JPEG（读取SOF段头，不解码）"""
+        if data[:2] != b"\xff\xd8":
+            return False
+        i, n = 2, len(data)
+        while i + 4 <= n:
+            if data[i] != 0xFF:
+                return False
+            marker = data[i + 1]
+            if marker == 0xFF:
+                # 填充字节
+                i += 1
+                continue
+            if 0xD0 <= marker <= 0xD8 or marker == 0x01:
+                # 无长度字段的标记
+                i += 2
+                continue
+            if marker in (0xC0, 0xC1, 0xC2):
+                # SOF段：长度(2) 精度(1) 高(2) 宽(2) 通道数(1)
+                return i + 10 <= n and data[i + 4] == 8 and data[i + 9] == 3
+            if marker in (0xDA, 0xD9) or (0xC3 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC)):
+                # 先遇到扫描数据/结束标记，或为GPU不支持的编码方式
+                return False
+            i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+        return False
+    
+    @staticmethod
+    def decode_images_gpu(data_list: List[bytes]) -> List[Optional[np.ndarray]]:
+        """使用nvImageCodec在GPU上批量解码，未能解码的条目为None（由调用方回退到decode_image）
+        
+        GPU解码固定输出8位3通道图像，与cv2.imdecode(IMREAD_UNCHANGED)只在8位彩色JPEG上一致；
+        灰度、16位、带透明通道等其他图像不送入GPU，返回None，保持原始通道数与位深。
+        """
+        decoded: List[Optional[np.ndarray]] = [None] * len(data_list)
+        if _nvimgcodec_decoder is None or not data_list:
+            return decoded
+        gpu_indices = [idx for idx, data in enumerate(data_list) if MedicalImageProcessor._is_color_jpeg8(data)]
+        if not gpu_indices:
+            return decoded
+        try:
+            gpu_images = _nvimgcodec_decoder.decode([data_list[idx] for idx in gpu_indices], params=_nvimgcodec_params)
+            for idx, gpu_img in zip(gpu_indices, gpu_images):
+                if gpu_img is not None:
+                    # nvImageCodec输出RGB，转换为与OpenCV一致的BGR
+                    decoded[idx] = cv2.cvtColor(np.asarray(gpu_img.cpu()), cv2.COLOR_RGB2BGR)
+            logger.debug(f"GPU批量解码完成，成功: {sum(d is not None for d in decoded)}/{len(data_list)}")
+        except Exception as e:
+            logger.warning(f"GPU批量解码失败，回退到OpenCV: {e}")
+        return decoded
     
     @staticmethod
-    def _to_gray(image: np.ndarray) -> np.ndarray:
+    def scratch_buffer(name: str, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """获取当前线程可复用的临时缓冲区（容量不足时才重新分配）"""
+        buffers = getattr(MedicalImageProcessor._scratch_local, "buffers", None)
+        if buffers is None:
+            buffers = MedicalImageProcessor._scratch_local.buffers = {}
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        buf = buffers.get((name, dtype))
+        if buf is None or buf.size < size:
+            buf = buffers[(name, dtype)] = np.empty(size, dtype=dtype)
+            logger.debug(f"分配临时缓冲区: {name}, 容量: {size}")
+        return buf[:size].reshape(shape)
+    
+    @staticmethod
+    def release_scratch_buffers():
+        """释放当前线程持有的临时缓冲区"""
+        MedicalImageProcessor._scratch_local.buffers = {}
+    
+    @staticmethod
+    def _fits(out: Optional[np.ndarray], shape: Tuple[int, ...], dtype) -> bool:
+        """判断输出缓冲区是否可直接作为目标数组使用"""
+        return out is not None and out.shape == tuple(shape) and out.dtype == dtype
+    
+    @staticmethod
+    def _to_gray(image: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
         """将图像转换为灰度图（辅助方法）"""
         if len(image.shape) == 3:
+            if MedicalImageProcessor._fits(out, image.shape[:2], image.dtype):
+                return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=out)
             return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        return image.copy() if image.dtype != np.uint8 else image
+        # 单通道图像直接返回原数组：调用方只读取灰度图，不会原地修改
+        return image
+    
+    @staticmethod
+    def _adjust_gray(gray: np.ndarray, apply_clahe: bool, contrast: float, brightness: int,
+                     out: Optional[np.ndarray] = None) -> np.ndarray:
+        """对灰度图应用CLAHE及对比度/亮度调整（辅助方法），out不能与输入共享内存"""
+        if not MedicalImageProcessor._fits(out, gray.shape, np.uint8):
+            out = None
+        
+        # 使用缓存的CLAHE对象
+        if apply_clahe:
+            clahe = MedicalImageProcessor._get_clahe(clip_limit=2.0, tile_grid_size=(8, 8))
+            if out is not None and gray.dtype == np.uint8:
+                gray = clahe.apply(gray, out)
+            else:
+                gray = clahe.apply(gray)
+        
+        # 调整对比度和亮度（8位图像只有256个取值，使用查找表代替逐像素浮点运算）
+        if gray.dtype != np.uint8:
+            gray = cv2.convertScaleAbs(gray, alpha=contrast, beta=brightness)
+        elif contrast != 1.0 or brightness != 0:
+            lut = _build_scale_lut(float(contrast), int(brightness))
+            # 查找表是逐元素操作，可以在输出缓冲区上原地执行
+            gray = cv2.LUT(gray, lut, dst=out) if out is not None else cv2.LUT(gray, lut)
+        return gray
     
     @staticmethod
     def preprocess_image(image: np.ndarray, apply_clahe: bool = True, 
-                         contrast: float = 1.0, brightness: int = 0) -> np.ndarray:
-        """图像预处理"""
+                         contrast: float = 1.0, brightness: int = 0,
+                         out: Optional[np.ndarray] = None) -> np.ndarray:
+        """图像预处理（可传入out复用输出缓冲区）"""
         try:
             gray = MedicalImageProcessor._to_gray(image)
-            
-            # 使用缓存的CLAHE对象
-            if apply_clahe:
-                clahe = MedicalImageProcessor._get_clahe(clip_limit=2.0, tile_grid_size=(8, 8))
-                gray = clahe.apply(gray)
-            
-            # 调整对比度和亮度
-            gray = cv2.convertScaleAbs(gray, alpha=contrast, beta=brightness)
+            gray = MedicalImageProcessor._adjust_gray(gray, apply_clahe, contrast, brightness, out=out)
             
             logger.debug(f"图像预处理完成，尺寸: {gray.shape}, apply_clahe: {apply_clahe}, contrast: {contrast}, brightness: {brightness}")
             return gray
@@ -59,17 +271,69 @@ class MedicalImageProcessor:
             raise
     
     @staticmethod
-    def enhance_pseudocolor(image: np.ndarray, color_scheme: str = "标准") -> np.ndarray:
-        """胸片灰度分层伪彩色增强"""
+    def preprocess_and_analyze(image: np.ndarray, apply_clahe: bool = True,
+                               contrast: float = 1.0, brightness: int = 0,
+                               out: Optional[np.ndarray] = None,
+                               exact: bool = False) -> PreprocResult:
+        """预处理并同时计算原图统计与预处理后直方图（只做一次灰度转换）
+        
+        传入out时预处理结果写入out，中间灰度图也使用线程内的临时缓冲区。
+        exact的含义与calculate_image_stats相同。
+        """
+        try:
+            gray_out = None
+            if out is not None:
+                gray_out = MedicalImageProcessor.scratch_buffer("gray", image.shape[:2], image.dtype)
+            gray = MedicalImageProcessor._to_gray(image, out=gray_out)
+            stats = MedicalImageProcessor._gray_stats(gray, exact=exact)
+            
+            processed = MedicalImageProcessor._adjust_gray(gray, apply_clahe, contrast, brightness, out=out)
+            # 在刚写完的预处理结果上直接统计直方图，数据仍在缓存中
+            histogram = MedicalImageProcessor._histogram_u8(processed)
+            
+            logger.debug(f"图像预处理与分析完成，尺寸: {processed.shape}, apply_clahe: {apply_clahe}, contrast: {contrast}, brightness: {brightness}")
+            return PreprocResult(image=processed, histogram=histogram, stats=stats)
+        except cv2.error as e:
+            logger.error(f"图像预处理与分析失败: {e}", exc_info=True)
+            raise
+        except Exception as e:
+            logger.error(f"图像预处理与分析时发生未知错误: {e}", exc_info=True)
+            raise
+    
+    @staticmethod
+    def enhance_pseudocolor(image: np.ndarray, color_scheme: str = "标准",
+                            out: Optional[np.ndarray] = None, parallel: bool = True) -> np.ndarray:
+        """胸片灰度分层伪彩色增强，输出BGR图像（可传入out复用输出缓冲区）
+
+        parallel=False时不使用Numba多线程内核：调用方已在多个线程中并行处理时，
+        每个线程再启动prange内核会使线程数成倍增加，且Numba的workqueue线程层不支持并发调用。
+        """
         try:
             gray = MedicalImageProcessor._to_gray(image)
+            if gray.dtype != np.uint8:
+                gray = np.clip(gray, 0, 255).astype(np.uint8)
             
-            color_img = np.zeros((gray.shape[0], gray.shape[1], 3), dtype=np.uint8)
-            layers = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES["标准"])
+            if not MedicalImageProcessor._fits(out, gray.shape + (3,), np.uint8):
+                out = None
             
-            for min_val, max_val, color in layers:
-                mask = (gray >= min_val) & (gray < max_val)
-                color_img[mask] = color
+            if parallel and _apply_color_lut is not None and gray.size > _NUMBA_MIN_PIXELS:
+                # 超大图像：多线程逐行查表，直接写入输出，不产生中间通道平面
+                luts = MedicalImageProcessor._color_luts
+                if out is None:
+                    out = np.empty(gray.shape + (3,), dtype=np.uint8)
+                color_img = _apply_color_lut(gray, luts.get(color_scheme, luts["标准"]), out)
+                logger.debug(f"伪彩色增强完成（Numba），尺寸: {color_img.shape}, 颜色方案: {color_scheme}")
+                return color_img
+            
+            luts = MedicalImageProcessor._channel_luts
+            channel_luts = luts.get(color_scheme, luts["标准"])
+            # 每个通道一次cv2.LUT查表再合并，比NumPy花式索引快约2倍
+            # 各通道平面只是合并前的中间结果，写入线程内复用的临时缓冲区
+            channels = [
+                cv2.LUT(gray, lut, dst=MedicalImageProcessor.scratch_buffer(f"lut_{c}", gray.shape))
+                for c, lut in enumerate(channel_luts)
+            ]
+            color_img = cv2.merge(channels, dst=out) if out is not None else cv2.merge(channels)
             
             logger.debug(f"伪彩色增强完成，尺寸: {color_img.shape}, 颜色方案: {color_scheme}")
             return color_img
@@ -81,20 +345,62 @@ class MedicalImageProcessor:
             raise
     
     @staticmethod
-    def calculate_image_stats(image: np.ndarray) -> Dict[str, float]:
-        """计算图像统计信息"""
+    def _histogram_u8(gray: np.ndarray) -> np.ndarray:
+        """计算8位灰度图的256级直方图（int64计数）"""
+        # cv2.calcHist原地SIMD统计，但以float32累计，像素数不超过2^24时计数精确
+        if gray.size <= 1 << 24:
+            return cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel().astype(np.int64)
+        return np.bincount(gray.ravel(), minlength=256)
+    
+    @staticmethod
+    def _hist_median(hist: np.ndarray, count: int) -> float:
+        """由直方图计算中位数（与np.median一致，偶数个元素时取中间两值的平均）"""
+        cum = np.cumsum(hist)
+        lower = int(np.searchsorted(cum, (count - 1) // 2, side="right"))
+        upper = int(np.searchsorted(cum, count // 2, side="right"))
+        return (lower + upper) / 2.0
+    
+    @staticmethod
+    def _gray_stats(gray: np.ndarray, hist: Optional[np.ndarray] = None, exact: bool = True) -> Dict[str, float]:
+        """计算灰度图统计信息（辅助方法），8位图像可传入已计算的直方图
+        
+        exact为False且图像很大时，均值/标准差/中位数在抽样后的像素上计算；
+        最小/最大值始终使用全部像素，避免漏掉极值。
+        """
+        min_val, max_val, _, _ = cv2.minMaxLoc(gray)
+        sample = gray
+        if not exact and gray.size > _STATS_SAMPLE_MIN_PIXELS:
+            sample = gray[::_STATS_SAMPLE_STEP, ::_STATS_SAMPLE_STEP]
+            hist = None
+        # 均值/标准差由OpenCV一次遍历得到
+        mean, std = cv2.meanStdDev(sample)
+        # 8位图像只有256个取值，用直方图累加求中位数代替排序
+        if sample.dtype == np.uint8:
+            if hist is None:
+                hist = MedicalImageProcessor._histogram_u8(sample)
+            median = MedicalImageProcessor._hist_median(hist, sample.size)
+        else:
+            median = float(np.median(sample))
+        return {
+            "min": float(min_val),
+            "max": float(max_val),
+            "mean": float(mean.item()),
+            "std": float(std.item()),
+            "width": float(gray.shape[1]),
+            "height": float(gray.shape[0]),
+            "median": median
+        }
+    
+    @staticmethod
+    def calculate_image_stats(image: np.ndarray, hist: Optional[np.ndarray] = None,
+                              exact: bool = False) -> Dict[str, float]:
+        """计算图像统计信息（可传入compute_histogram的结果，避免重复统计直方图）
+        
+        exact为False时超大图像的均值/标准差/中位数采用抽样估计，需要精确值时传入exact=True。
+        """
         try:
             gray = MedicalImageProcessor._to_gray(image)
-            
-            stats = {
-                "min": float(np.min(gray)),
-                "max": float(np.max(gray)),
-                "mean": float(np.mean(gray)),
-                "std": float(np.std(gray)),
-                "width": float(gray.shape[1]),
-                "height": float(gray.shape[0]),
-                "median": float(np.median(gray))
-            }
+            stats = MedicalImageProcessor._gray_stats(gray, hist=hist, exact=exact)
             
             logger.debug(f"图像统计计算完成，尺寸: {gray.shape}")
             return stats
@@ -108,6 +414,15 @@ class MedicalImageProcessor:
     @staticmethod
     def convert_to_pil(image: np.ndarray) -> 'Image':
         try:
+            if image.ndim == 2 and image.dtype == np.uint8:
+                # 8位灰度图直接构造L模式图像，无需扩展为三通道
+                logger.debug(f"图像转换为PIL格式完成（灰度），尺寸: {image.shape}")
+                return Image.fromarray(image)
+            if image.ndim == 3 and image.shape[2] == 3 and image.dtype == np.uint8:
+                # 由PIL的raw解码器按BGR顺序直接解包到图像内存，省去cvtColor生成的中间RGB数组
+                height, width = image.shape[:2]
+                logger.debug(f"图像转换为PIL格式完成，尺寸: {image.shape}")
+                return Image.frombuffer("RGB", (width, height), np.ascontiguousarray(image), "raw", "BGR", 0, 1)
             if len(image.shape) == 3:
                 rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             else:
@@ -122,6 +437,46 @@ class MedicalImageProcessor:
             logger.error(f"图像转换为PIL格式时发生未知错误: {e}", exc_info=True)
             raise
     
+    @staticmethod
+    def encode_jpeg(image: np.ndarray, quality: int = 95, channels: str = "BGR", optimize: bool = False) -> bytes:
+        """将BGR（或channels="RGB"）/灰度图像编码为JPEG字节，优先使用simplejpeg，否则使用OpenCV
+
+        默认输出基线（非渐进）、不做哈夫曼表优化、4:2:0色度采样的JPEG，这是libjpeg最快的编码路径；
+        optimize=True时额外做一遍哈夫曼表优化以减小文件（仅OpenCV支持）。
+        """
+        try:
+            if (simplejpeg is not None and not optimize and image.dtype == np.uint8
+                    and (image.ndim == 2 or image.shape[2] == 3)):
+                if image.ndim == 2:
+                    data = simplejpeg.encode_jpeg(np.ascontiguousarray(image)[:, :, np.newaxis], quality=quality,
+                                                  colorspace="GRAY", fastdct=True)
+                else:
+                    data = simplejpeg.encode_jpeg(np.ascontiguousarray(image), quality=quality, colorspace=channels,
+                                                  colorsubsampling="420", fastdct=True)
+                logger.debug(f"JPEG编码完成（simplejpeg），尺寸: {image.shape}, 质量: {quality}")
+                return data
+            
+            if channels == "RGB" and image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            params = [
+                int(cv2.IMWRITE_JPEG_QUALITY), quality,
+                int(cv2.IMWRITE_JPEG_OPTIMIZE), int(optimize),
+                int(cv2.IMWRITE_JPEG_PROGRESSIVE), 0,
+                int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR), int(cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420),
+            ]
+            ok, encoded = cv2.imencode(".jpg", image, params)
+            if not ok:
+                raise ValueError("JPEG编码失败")
+            
+            logger.debug(f"JPEG编码完成，尺寸: {image.shape}, 质量: {quality}")
+            return encoded.tobytes()
+        except cv2.error as e:
+            logger.error(f"JPEG编码失败: {e}", exc_info=True)
+            raise
+        except Exception as e:
+            logger.error(f"JPEG编码时发生未知错误: {e}", exc_info=True)
+            raise
+    
     @staticmethod
     def resize_image(image: np.ndarray, max_size: Tuple[int, int] = (1024, 1024)) -> np.ndarray:
         """调整图像大小（保持宽高比）"""
@@ -147,11 +502,10 @@ class MedicalImageProcessor:
 
     @staticmethod
     def generate_legend(color_scheme: str = "标准") -> np.ndarray:
+        """获取颜色方案的BGR图例"""
         try:
-            layers = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES["标准"])
-            legend = np.zeros((40, 256, 3), dtype=np.uint8)
-            for min_val, max_val, color in layers:
-                legend[:, min_val:max_val] = color
+            legends = MedicalImageProcessor._legend_cache
+            legend = legends.get(color_scheme, legends["标准"])
             
             logger.debug(f"图例生成完成，颜色方案: {color_scheme}")
             return legend
@@ -166,7 +520,10 @@ class MedicalImageProcessor:
     def compute_histogram(image: np.ndarray) -> np.ndarray:
         try:
             gray = MedicalImageProcessor._to_gray(image)
-            counts = np.bincount(gray.flatten(), minlength=256)
+            if gray.dtype == np.uint8:
+                counts = MedicalImageProcessor._histogram_u8(gray)
+            else:
+                counts = np.bincount(gray.ravel(), minlength=256)
             
             logger.debug(f"直方图计算完成，尺寸: {gray.shape}")
             return counts
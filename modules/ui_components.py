@@ -1,24 +1,137 @@
 # modules/ui_components.py
 
 import streamlit as st
-from typing import Dict, Any, List, Optional
+from collections import namedtuple
+from functools import lru_cache
+from itertools import islice
+from typing import Dict, Any, List, Optional, Iterable
 from PIL import Image
 from io import BytesIO
+import cv2
+import numpy as np
 import pandas as pd
 from .config import APP_CONFIG
+from .image_processor import MedicalImageProcessor
+
+
+# 侧边栏控件的session_state键，去掉"sb_"前缀即为create_sidebar返回字典的键
+_SIDEBAR_KEYS = (
+    "sb_color_scheme", "sb_apply_clahe", "sb_contrast", "sb_brightness",
+    "sb_save_to_history", "sb_show_stats", "sb_db_enabled", "sb_db_type", "sb_db_path",
+)
+
+# 侧边栏默认值只依赖配置，导入时计算一次
+_SIDEBAR_DEFAULTS = {
+    "color_scheme": "标准",
+    "apply_clahe": True,
+    "contrast": 1.0,
+    "brightness": 0,
+    "save_to_history": True,
+    "show_stats": True,
+    "db_enabled": APP_CONFIG.get("db_enabled", False),
+    "db_type": APP_CONFIG.get("db_type", "sqlite"),
+    "db_path": APP_CONFIG.get("db_path", "medical_images.db"),
+}
+
+
+# 直方图图片尺寸（每个灰度级占2个像素宽）
+_HIST_WIDTH = 512
+_HIST_HEIGHT = 200
+# 柱形颜色（BGR，与页面主题蓝色一致）
+_HIST_COLOR = (180, 119, 31)
+# 画布行坐标（列向量），与柱高比较得到填充掩码；只构造一次
+_HIST_ROWS = np.arange(_HIST_HEIGHT)[:, np.newaxis]
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _histogram_png(counts: np.ndarray) -> bytes:
+    """将256级直方图绘制为柱状图PNG字节（直接用NumPy绘制，不经过图表库）"""
+    counts = np.asarray(counts, dtype=np.float64)
+    peak = counts.max() if counts.size else 0
+    if peak > 0:
+        heights = np.round(counts / peak * _HIST_HEIGHT).astype(np.int64)
+    else:
+        heights = np.zeros(256, dtype=np.int64)
+    # 每一行只填充柱高覆盖到的列
+    mask = np.repeat(_HIST_ROWS >= _HIST_HEIGHT - heights[np.newaxis, :], _HIST_WIDTH // 256, axis=1)
+    canvas = np.full((_HIST_HEIGHT, _HIST_WIDTH, 3), 255, dtype=np.uint8)
+    canvas[mask] = _HIST_COLOR
+    ok, encoded = cv2.imencode(".png", canvas)
+    if not ok:
+        raise ValueError("直方图PNG编码失败")
+    return encoded.tobytes()
+
+
+# 页面显示的最大宽度（像素），更宽的图像先缩小再发送给浏览器
+_DISPLAY_MAX_WIDTH = APP_CONFIG.get("display_max_width", 800)
+# 批量处理结果预览缩略图的宽度（像素）
+_PREVIEW_WIDTH = APP_CONFIG.get("preview_width", 512)
+# 页面显示用的JPEG质量（仅用于预览，下载仍使用质量95的原分辨率编码）
+_DISPLAY_JPEG_QUALITY = APP_CONFIG.get("display_jpeg_quality", 85)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _encode_for_display(image: np.ndarray, max_width: Optional[int] = None,
+                        quality: int = _DISPLAY_JPEG_QUALITY) -> bytes:
+    """将BGR/灰度图像编码为JPEG字节并缓存（st.image每次重跑都会重新编码数组，像素不变时直接复用）
+
+    指定max_width且图像更宽时，先按比例缩小到该宽度，只发送显示分辨率的数据。
+    页面上所有预览图（对比图、图例、批量结果缩略图）都经由此函数编码。
+    """
+    if max_width and image.shape[1] > max_width:
+        height = max(1, round(image.shape[0] * max_width / image.shape[1]))
+        image = cv2.resize(image, (max_width, height), interpolation=cv2.INTER_AREA)
+    return MedicalImageProcessor.encode_jpeg(image, quality=quality)
+
+
+# 查询结果表格显示的列
+_HISTORY_COLUMNS = ["timestamp", "filename", "color_scheme", "original_shape"]
+
+# 分页显示用的记录视图：每页只从字典取值一次，之后按属性访问
+HistoryRecord = namedtuple(
+    "HistoryRecord", "timestamp filename color_scheme original_shape enhanced_shape stats"
+)
+_EMPTY_SHAPE = (0, 0)
+_EMPTY_STATS: Dict[str, Any] = {}
+
+
+def _to_history_record(record: Dict) -> HistoryRecord:
+    """将历史记录字典转换为HistoryRecord（缺失字段取显示用默认值）"""
+    return HistoryRecord(
+        record.get('timestamp') or 'N/A',
+        record.get('filename') or 'N/A',
+        record.get('color_scheme') or 'N/A',
+        record.get('original_shape') or _EMPTY_SHAPE,
+        record.get('enhanced_shape') or _EMPTY_SHAPE,
+        record.get('stats') or _EMPTY_STATS,
+    )
+
+
+@lru_cache(maxsize=1024)
+def _format_row(timestamp: str, filename: str, width: int, height: int) -> tuple:
+    """生成记录的详情面板标题与尺寸文本（同一记录每次重跑结果不变）"""
+    return f"📈 {filename} · {timestamp}", f"{width}x{height}"
+
+
+def _row_text(record: HistoryRecord) -> tuple:
+    """返回记录的 (详情面板标题, 尺寸文本)"""
+    return _format_row(record.timestamp, record.filename, record.original_shape[1], record.original_shape[0])
 
 class UIComponents:
     """UI组件类"""
     
     @staticmethod
     def setup_page_config():
-        """设置页面配置"""
+        """设置页面配置（每个会话只设置一次，之后的重跑沿用已下发的配置）"""
+        if st.session_state.get("_page_configured"):
+            return
         st.set_page_config(
             page_title="胸片增强系统",
             page_icon="🩺",
             layout="wide",
             initial_sidebar_state="expanded"
         )
+        st.session_state["_page_configured"] = True
     
     @staticmethod
     def create_sidebar() -> Dict[str, Any]:
@@ -26,46 +139,38 @@ class UIComponents:
         st.sidebar.title("⚙️ 控制面板")
         st.sidebar.markdown("---")
         
-        # 颜色方案选择
-        color_scheme = st.sidebar.selectbox(
+        defaults = _SIDEBAR_DEFAULTS
+        # 颜色方案选择（各控件使用固定key，取值直接从session_state读取）
+        st.sidebar.selectbox(
             "🎨 选择颜色方案",
             ["标准", "高对比度", "柔和"],
             index=0,
-            help="不同的颜色方案适用于不同的组织显示"
+            help="不同的颜色方案适用于不同的组织显示",
+            key="sb_color_scheme"
         )
         
         # 增强选项
         st.sidebar.markdown("### 增强选项")
-        apply_clahe = st.sidebar.checkbox("应用CLAHE增强", value=True)
-        contrast = st.sidebar.slider("对比度增强", 0.5, 2.0, 1.0, 0.1)
-        brightness = st.sidebar.slider("亮度调节", -50, 50, 0, 5)
+        st.sidebar.checkbox("应用CLAHE增强", value=defaults["apply_clahe"], key="sb_apply_clahe")
+        st.sidebar.slider("对比度增强", 0.5, 2.0, defaults["contrast"], 0.1, key="sb_contrast")
+        st.sidebar.slider("亮度调节", -50, 50, defaults["brightness"], 5, key="sb_brightness")
         
         # 保存选项
-        save_to_history = st.sidebar.checkbox("保存到历史记录", value=True)
+        st.sidebar.checkbox("保存到历史记录", value=defaults["save_to_history"], key="sb_save_to_history")
         
         # 其他选项
         st.sidebar.markdown("### 其他选项")
-        show_stats = st.sidebar.checkbox("显示详细统计", value=True)
+        st.sidebar.checkbox("显示详细统计", value=defaults["show_stats"], key="sb_show_stats")
         st.sidebar.markdown("### 数据库设置")
-        db_enabled = st.sidebar.checkbox("启用数据库持久化", value=APP_CONFIG.get("db_enabled", False))
-        db_type = st.sidebar.selectbox("数据库类型", ["sqlite", "mysql"], index=0 if APP_CONFIG.get("db_type", "sqlite") == "sqlite" else 1)
+        st.sidebar.checkbox("启用数据库持久化", value=defaults["db_enabled"], key="sb_db_enabled")
+        db_type = st.sidebar.selectbox("数据库类型", ["sqlite", "mysql"], index=0 if defaults["db_type"] == "sqlite" else 1, key="sb_db_type")
 
-        db_path = APP_CONFIG.get("db_path", "medical_images.db")
         if db_type == "sqlite":
-            db_path = st.sidebar.text_input("sqlite文件路径", value=db_path)
+            st.sidebar.text_input("sqlite文件路径", value=defaults["db_path"], key="sb_db_path")
 
-        return {
-            "color_scheme": color_scheme,
-            "apply_clahe": apply_clahe,
-            "contrast": contrast,
-            "brightness": brightness,
-            "save_to_history": save_to_history,
-            "show_stats": show_stats,
-            "db_enabled": db_enabled,
-            "db_type": db_type,
-            "db_path": db_path,
-
-        }
+        # 未渲染的控件（如选择MySQL时的文件路径）没有session_state值，使用默认值
+        state = st.session_state
+        return {key[3:]: state[key] if key in state else defaults[key[3:]] for key in _SIDEBAR_KEYS}
     
     @staticmethod
     def create_header(history_count: int = 0):
@@ -98,7 +203,8 @@ class UIComponents:
         
         with col1:
             st.markdown("#### 📷 原始胸片")
-            st.image(original_img, caption=f"尺寸: {original_img.shape[1]}x{original_img.shape[0]}", 
+            # BGR/灰度图像缩小到显示宽度并编码后缓存，重跑时只发送已编码的字节（标题仍显示原始尺寸）
+            st.image(_encode_for_display(original_img, _DISPLAY_MAX_WIDTH), caption=f"尺寸: {original_img.shape[1]}x{original_img.shape[0]}", 
                     use_column_width=True)
             
             if original_stats:
@@ -107,29 +213,61 @@ class UIComponents:
         
         with col2:
             st.markdown("#### 🎨 增强图像")
-            st.image(enhanced_img, caption="伪彩色增强处理", use_column_width=True)
+            st.image(_encode_for_display(enhanced_img, _DISPLAY_MAX_WIDTH), caption="伪彩色增强处理", use_column_width=True)
 
     @staticmethod
-    def show_histogram(counts: List[int]):
-        df = pd.DataFrame({"intensity": list(range(256)), "count": list(counts)})
+    def show_histogram(counts: np.ndarray):
+        # 预先绘制并缓存为PNG，避免每次重跑构造DataFrame并由前端重新渲染图表
+        # compute_histogram已返回256级ndarray，这里直接使用，不再经过Python列表
         st.markdown("#### 📈 灰度直方图")
-        st.bar_chart(df.set_index("intensity"), use_container_width=True)
+        counts = np.asarray(counts)
+        st.image(_histogram_png(counts), caption=f"横轴: 灰度级 0-255，纵轴: 像素数（峰值 {int(counts.max())}）",
+                 use_column_width=True)
+
+    @staticmethod
+    def show_preview_image(image: np.ndarray, caption: str, max_width: int = _PREVIEW_WIDTH):
+        """显示批量处理结果的预览缩略图（与对比图使用同一缩放与编码函数）"""
+        st.image(_encode_for_display(image, max_width), caption=caption, use_column_width=True)
 
     @staticmethod
     def show_legend(legend_img):
         st.markdown("#### 🎨 颜色图例")
-        st.image(legend_img, caption="强度分段颜色映射", use_column_width=True)
+        st.image(_encode_for_display(legend_img), caption="强度分段颜色映射", use_column_width=True)
     
     @staticmethod
     def create_download_button(image: Image.Image, filename: str = "enhanced_image.jpg") -> BytesIO:
-        """创建下载按钮数据"""
-        buf = BytesIO()
-        image.save(buf, format="JPEG", quality=95)
-        buf.seek(0)
-        return buf
+        """创建下载按钮数据（使用与增强图像下载相同的JPEG编码器）"""
+        rgb = np.asarray(image.convert("RGB"))
+        return BytesIO(MedicalImageProcessor.encode_jpeg(rgb, quality=95, channels="RGB"))
     
     @staticmethod
-    def show_history_table(history_list: List[Dict], max_entries: int = 10):
+    def _history_page_columns(records: List[HistoryRecord]) -> Dict[str, List]:
+        """将一页历史记录按列组织，供单个st.dataframe渲染"""
+        return {
+            "文件名": [record.filename for record in records],
+            "时间": [record.timestamp for record in records],
+            "颜色方案": [record.color_scheme for record in records],
+            "原始尺寸": [_row_text(record)[1] for record in records],
+        }
+
+    @staticmethod
+    def _show_record_details(records: List[HistoryRecord]):
+        """逐条显示记录详情（折叠面板，展开查看时不会触发整页重跑）"""
+        for record in records:
+            with st.expander(_row_text(record)[0], expanded=False):
+                st.json({
+                    "基本": {
+                        "时间": record.timestamp,
+                        "文件名": record.filename,
+                        "颜色方案": record.color_scheme,
+                        "原始尺寸": record.original_shape,
+                        "增强尺寸": record.enhanced_shape,
+                    },
+                    "统计": record.stats,
+                })
+
+    @staticmethod
+    def show_history_table(history_list: Iterable[Dict], max_entries: int = 10):
         """显示历史记录表格"""
         if not history_list:
             st.info("📭 暂无历史记录。上传并处理图像后，记录将显示在这里。")
@@ -137,70 +275,24 @@ class UIComponents:
         
         # 显示最近记录
         with st.expander("📋 最近处理记录", expanded=True):
-            recent_entries = history_list[:5]
-            df = pd.DataFrame(recent_entries)
-            
-            if not df.empty:
-                # 重命名列名
-                column_names = {
-                    "timestamp": "时间",
-                    "filename": "文件名",
-                    "color_scheme": "颜色方案",
-                    "original_shape": "原始尺寸",
-                    "enhanced_shape": "增强后尺寸"
-                }
-                df_display = df.rename(columns=column_names)
-                
-                # 只显示需要的列
-                display_cols = ["时间", "文件名", "颜色方案", "原始尺寸"]
-                df_display = df_display[display_cols] if all(col in df_display.columns for col in display_cols) else df_display
-                
-                st.dataframe(df_display, use_container_width=True, hide_index=True)
+            # 只有5行，直接按列组织数据交给st.dataframe，不再构造并重命名DataFrame
+            recent_entries = list(islice(history_list, 5))
+            st.dataframe(
+                {
+                    "时间": [r.get("timestamp", "") for r in recent_entries],
+                    "文件名": [r.get("filename", "") for r in recent_entries],
+                    "颜色方案": [r.get("color_scheme", "") for r in recent_entries],
+                    "原始尺寸": [r.get("original_shape", (0, 0)) for r in recent_entries],
+                },
+                use_container_width=True,
+                hide_index=True
+            )
         
         # 详细历史记录（分页显示）
         st.markdown("### 📊 历史记录详情")
         
-        # 分页设置
-        page_size = 5
-        total_pages = (len(history_list) + page_size - 1) // page_size
-        current_page = st.selectbox(
-            "选择页码",
-            range(1, total_pages + 1),
-            index=0
-        )
-        
-        start_idx = (current_page - 1) * page_size
-        end_idx = start_idx + page_size
-        paginated_records = history_list[start_idx:end_idx]
-        
-        # 显示当前页记录
-        for i, record in enumerate(paginated_records):
-            with st.container():
-                cols = st.columns([2, 1, 1, 1])
-                cols[0].write(f"**{record.get('filename', 'N/A')}**")
-                cols[1].write(f"📅 {record.get('timestamp', 'N/A')}")
-                cols[2].write(f"🎨 {record.get('color_scheme', 'N/A')}")
-                cols[3].write(f"📏 {record.get('original_shape', (0, 0))[1]}x{record.get('original_shape', (0, 0))[0]}")
-                
-                # 使用唯一的键
-                unique_key = f"stats_{start_idx + i}"
-                if cols[3].button("📈 详情", key=unique_key):
-                    with st.expander("记录详情", expanded=True):
-                        st.json({
-                            "基本": {
-                                "时间": record.get('timestamp', 'N/A'),
-                                "文件名": record.get('filename', 'N/A'),
-                                "颜色方案": record.get('color_scheme', 'N/A'),
-                                "原始尺寸": record.get('original_shape', (0, 0)),
-                                "增强尺寸": record.get('enhanced_shape', (0, 0)),
-                            },
-                            "统计": record.get('stats', {}),
-                        })
-                
-                st.markdown("---")
-        
-        # 显示分页信息
-        st.caption(f"显示第 {current_page} 页，共 {total_pages} 页，总计 {len(history_list)} 条记录")
+        # 翻页只重跑分页片段，不重跑整页
+        _render_history_page(list(history_list), key_prefix="history", show_table=True)
     
     @staticmethod
     def create_footer(history_count: int = 0):
@@ -238,55 +330,57 @@ class UIComponents:
             st.info("无匹配记录")
             return
         
-        # 显示查询结果表格
-        df = pd.DataFrame(records)
+        # 显示查询结果表格（查询结果已由数据库分页，构造时只取需要显示的列）
+        df = pd.DataFrame(records, columns=_HISTORY_COLUMNS)
         if not df.empty:
             st.dataframe(
-                df[["timestamp", "filename", "color_scheme", "original_shape"]], 
+                df, 
                 use_container_width=True,
                 hide_index=True
             )
         
         st.markdown("### 记录列表")
         
-        # 分页设置
-        page_size = 5
-        total_pages = (len(records) + page_size - 1) // page_size
+        # 上方表格已列出全部结果，这里只为当前页记录提供详情折叠面板
+        _render_history_page(records, key_prefix="query", show_table=False)
+
+
+# st.fragment（1.37+，1.33-1.36为st.experimental_fragment）只重跑被装饰的函数；旧版本退化为普通函数
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+@_fragment
+def _render_history_page(records: List[Dict], key_prefix: str, page_size: int = 5, show_table: bool = True):
+    """分页显示历史记录：页码选择、当前页表格（可选）、详情折叠面板与分页信息
+
+    key_prefix区分同一页面上的多个分页区域（如"history"、"query"），避免页码选择框的控件ID冲突。
+    """
+    total_pages = (len(records) + page_size - 1) // page_size
+    if len(records) <= page_size:
+        # 记录不足一页时不渲染页码选择框
+        current_page = 1
+        paginated_records = records
+    else:
         current_page = st.selectbox(
             "选择页码",
             range(1, total_pages + 1),
-            index=0
+            index=0,
+            key=f"{key_prefix}_page"
         )
-        
         start_idx = (current_page - 1) * page_size
         end_idx = start_idx + page_size
         paginated_records = records[start_idx:end_idx]
-        
-        # 显示当前页记录
-        for i, record in enumerate(paginated_records):
-            with st.container():
-                cols = st.columns([2, 1, 1, 1])
-                cols[0].write(f"**{record.get('filename', 'N/A')}**")
-                cols[1].write(f"📅 {record.get('timestamp', 'N/A')}")
-                cols[2].write(f"🎨 {record.get('color_scheme', 'N/A')}")
-                cols[3].write(f"📏 {record.get('original_shape', (0, 0))[1]}x{record.get('original_shape', (0, 0))[0]}")
-                
-                # 使用唯一的键
-                unique_key = f"query_stats_{start_idx + i}"
-                if cols[3].button("📈 详情", key=unique_key):
-                    with st.expander("记录详情", expanded=True):
-                        st.json({
-                            "基本": {
-                                "时间": record.get('timestamp', 'N/A'),
-                                "文件名": record.get('filename', 'N/A'),
-                                "颜色方案": record.get('color_scheme', 'N/A'),
-                                "原始尺寸": record.get('original_shape', (0, 0)),
-                                "增强尺寸": record.get('enhanced_shape', (0, 0)),
-                            },
-                            "统计": record.get('stats', {}),
-                        })
-                
-                st.markdown("---")
-        
-        # 显示分页信息
-        st.caption(f"显示第 {current_page} 页，共 {total_pages} 页，总计 {len(records)} 条记录")
+    
+    # 当前页记录只转换一次，表格与详情面板共用
+    page_records = [_to_history_record(record) for record in paginated_records]
+    if show_table:
+        # 当前页合并为一个表格渲染，详情放在下方的折叠面板中
+        st.dataframe(
+            UIComponents._history_page_columns(page_records),
+            use_container_width=True,
+            hide_index=True
+        )
+    UIComponents._show_record_details(page_records)
+    
+    # 显示分页信息
+    st.caption(f"显示第 {current_page} 页，共 {total_pages} 页，总计 {len(records)} 条记录")